@@ -1,9 +1,9 @@
 import argparse
 from enum import StrEnum
 import math
-from typing import Final
+from typing import Final, NotRequired, TypedDict
 from l2g.code_gen import (
-    ProgramWithMeta,
+    Radian,
     Vector2D,
     compile_program,
     deg_to_rad,
@@ -12,64 +12,78 @@ from l2g.code_gen import (
 from l2g.l_system import LSystem
 
 
-KOCH_SNOWFLAKE: Final[ProgramWithMeta] = compile_program(
-    system=LSystem(
-        axiom=["F", "+", "+", "F", "+", "+", "F"],
-        production_rules={"F": ["F", "-", "F", "+", "+", "F", "-", "F"]},
-    ),
-    nb_iterations=6,
-    angle_increment=math.pi / 3,
-    step_size=1.5,
-    init_pos=Vector2D(0, 36)
-)
-
-HILBERT_CURVE: Final[ProgramWithMeta] = compile_program(
-    system=LSystem(
-        axiom=["A"],
-        production_rules={
-            "A": ["+", "B", "F", "-", "A", "F", "A", "-", "F", "B", "+"],
-            "B": ["-", "A", "F", "+", "B", "F", "B", "+", "F", "A", "-"],
-        },
-    ),
-    nb_iterations=5,
-    angle_increment=math.pi / 2,
-    step_size=5,
-)
-
-SIERPINSKY_TRIANGLE: Final[ProgramWithMeta] = compile_program(
-    system=LSystem(
-        axiom=["F", "-", "G", "-", "G"],
-        production_rules={
-            "F": ["F", "-", "G", "+", "F", "+", "G", "-", "F"],
-            "G": ["G", "G"],
-        },
-    ),
-    nb_iterations=5,
-    angle_increment=math.pi * 2 / 3,
-    step_size=4,
-    init_angle=math.pi/3
-)
-
-BARNSLEY_FERN: Final[ProgramWithMeta] = compile_program(
-    system=LSystem(
-        axiom=["-", "X"],
-        production_rules={
-            "X": ["F", "+", "[", "[", "X", "]", "-", "X", "]", "-", "F", "[", "-", "F", "X", "]", "+", "X"],
-            "F": ["F", "F"]
-        }
-    ),
-    angle_increment=deg_to_rad(25),
-    init_angle=math.pi/2-0.1,
-    nb_iterations=7,
-    step_size=0.5
-)
-
 class Figure(StrEnum):
     KOCH = "KOCH"
     HILBERT = "HILBERT"
     SIERPINSKY = "SIERPINSKY"
     BARNSLEY = "BARNSLEY"
 
+
+class FigureParameters(TypedDict):
+    """
+    Arguments of `compile_program` for a figure
+    """
+
+    system: LSystem
+    nb_iterations: int
+    angle_increment: Radian
+    step_size: float
+    init_angle: NotRequired[Radian]
+    init_pos: NotRequired[Vector2D]
+
+
+# Only the requested figure gets compiled
+FIGURES: Final[dict[Figure, FigureParameters]] = {
+    Figure.KOCH: FigureParameters(
+        system=LSystem(
+            axiom=b"F++F++F",
+            production_rules={b"F": b"F-F++F-F"},
+        ),
+        nb_iterations=6,
+        angle_increment=math.pi / 3,
+        step_size=1.5,
+        init_pos=Vector2D(0, 36)
+    ),
+    Figure.HILBERT: FigureParameters(
+        system=LSystem(
+            axiom=b"A",
+            production_rules={
+                b"A": b"+BF-AFA-FB+",
+                b"B": b"-AF+BFB+FA-",
+            },
+        ),
+        nb_iterations=5,
+        angle_increment=math.pi / 2,
+        step_size=5,
+    ),
+    Figure.SIERPINSKY: FigureParameters(
+        system=LSystem(
+            axiom=b"F-G-G",
+            production_rules={
+                b"F": b"F-G+F+G-F",
+                b"G": b"GG",
+            },
+        ),
+        nb_iterations=5,
+        angle_increment=math.pi * 2 / 3,
+        step_size=4,
+        init_angle=math.pi/3
+    ),
+    Figure.BARNSLEY: FigureParameters(
+        system=LSystem(
+            axiom=b"-X",
+            production_rules={
+                b"X": b"F+[[X]-X]-F[-FX]+X",
+                b"F": b"FF"
+            }
+        ),
+        angle_increment=deg_to_rad(25),
+        init_angle=math.pi/2-0.1,
+        nb_iterations=7,
+        step_size=0.5
+    ),
+}
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='l2g: Generate G-Code for your L-System')
 
@@ -79,13 +93,4 @@ if __name__ == "__main__":
     # Parse the arguments
     args = parser.parse_args()
 
-    if args.figure == Figure.BARNSLEY:
-        write_nc(BARNSLEY_FERN, "barnsley")
-    elif args.figure == Figure.KOCH:
-        write_nc(KOCH_SNOWFLAKE, "koch")
-    elif args.figure == Figure.HILBERT:
-        write_nc(HILBERT_CURVE, "hilbert")
-    elif args.figure == Figure.SIERPINSKY:
-        write_nc(SIERPINSKY_TRIANGLE, "sierpinsky")
-
-
+    write_nc(compile_program(**FIGURES[args.figure]), args.figure.lower())
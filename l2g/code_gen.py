@@ -1,16 +1,57 @@
-from copy import copy
 from dataclasses import dataclass
 from enum import IntEnum
+from itertools import accumulate, compress
 import math
-from typing import Final, Literal, NewType, Optional, TypedDict
+import re
+from typing import Callable, Final, Literal, NewType, Optional, TypedDict
 
 from l2g.l_system import LSystem, Symbol
 
 
 FEED_RATE: Final[float] = 100
 LINE_DEPTH: Final[float] = -0.5
+# Height the tool travels at between two branches
+TRAVEL_HEIGHT: Final[float] = 3
+TURN_LEFT: Final[Symbol] = ord("+")
+TURN_RIGHT: Final[Symbol] = ord("-")
+DRAW_F: Final[Symbol] = ord("F")
+DRAW_G: Final[Symbol] = ord("G")
+PUSH: Final[Symbol] = ord("[")
+POP: Final[Symbol] = ord("]")
+# Turtle actions of the symbols, numbered by how often they usually occur
+ACTION_DRAW: Final[int] = 0
+ACTION_TURN_LEFT: Final[int] = 1
+ACTION_TURN_RIGHT: Final[int] = 2
+ACTION_PUSH: Final[int] = 3
+ACTION_POP: Final[int] = 4
+# Code of the symbols without action, which must be deleted before drawing
+ACTION_NONE: Final[int] = 0xFF
+SYMBOL_ACTIONS: Final[dict[Symbol, int]] = {
+    DRAW_F: ACTION_DRAW,
+    DRAW_G: ACTION_DRAW,
+    TURN_LEFT: ACTION_TURN_LEFT,
+    TURN_RIGHT: ACTION_TURN_RIGHT,
+    PUSH: ACTION_PUSH,
+    POP: ACTION_POP,
+}
+# bytes.translate table from symbols to their action
+ACTIONS: Final[bytes] = bytes(SYMBOL_ACTIONS.get(i, ACTION_NONE) for i in range(256))
+# Symbols ignored during drawing, deleted by the translation
+NO_ACTION: Final[bytes] = bytes(i for i in range(256) if i not in SYMBOL_ACTIONS)
+WRITE_BUFFER_SIZE: Final[int] = 1 << 20
+# Largest number of angle increments searched for a whole number of turns
+MAX_PERIOD: Final[int] = 720
+# 1 for the symbols that move the turtle forward, 0 otherwise
+DRAW_MASK: Final[bytes] = bytes(int(i in (DRAW_F, DRAW_G)) for i in range(256))
+# Innermost [...] group without any draw symbol
+SILENT_BRANCH: Final[re.Pattern[bytes]] = re.compile(rb"\[[^\[\]FG]*\]")
+# Line of the pen-down move to a position, formatted from an (x, y) pair
+DRAW_FORMAT: Final[str] = f"G01 X%.2f Y%.2f Z{LINE_DEPTH:.2f} F{FEED_RATE}"
+# Line of the rapid move above a position, formatted from an (x, y) pair
+TRAVEL_FORMAT: Final[str] = f"G00 X%.2f Y%.2f Z{TRAVEL_HEIGHT:.2f}"
 type Radian = float
-type GCodeProgram = list[GCodeInstruction]
+# Formatted G-code lines
+type GCodeProgram = list[str]
 
 
 class Vector2D:
@@ -20,25 +61,15 @@ class Vector2D:
 
 
 class Position3D:
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x: float = 0.0, y: float = 0.0, z: float = 0.0):
         self.x = x
         self.y = y
         self.z = z
 
-    def __eq__(self, other):
-        if isinstance(other, Position3D):
-            return self.x == other.x and self.y == other.y and self.z == other.z
-        return False
-
-    def add(self, v: Vector2D) -> "Position3D":
-        return Position3D(self.x + v.x, self.y + v.y, self.z)
-
-    def above(self, z: float = 3) -> "Position3D":
-        return Position3D(self.x, self.y, z)
-
     def build(self) -> str:
-        ndigits = 2
-        return f"X{round(self.x, ndigits=ndigits)} Y{round(self.y, ndigits=ndigits)} Z{round(self.z, ndigits=ndigits)}"
+        return "X%.2f Y%.2f Z%.2f" % (self.x, self.y, self.z)
 
 
 class Command(IntEnum):
@@ -56,17 +87,24 @@ class GCodeInstruction:
         self.dst_pos = dst_pos
         self.command = command
         self.feed_rate = feed_rate
+        # Rapid moves never carry a feed rate: pick the formatter once
+        self.build: Callable[[], str] = (
+            self._build_move
+            if feed_rate is None or command == Command.RAPID_POSITIONING
+            else self._build_feed_move
+        )
 
-    def build(self):
-        out = f"G{self.command:02} {self.dst_pos.build()}"
-        if not self.feed_rate is None and self.command != Command.RAPID_POSITIONING:
-            out += f" F{self.feed_rate}"
-        return out
+    def _build_move(self) -> str:
+        return "G%02d %s" % (self.command, self.dst_pos.build())
+
+    def _build_feed_move(self) -> str:
+        return "G%02d %s F%s" % (self.command, self.dst_pos.build(), self.feed_rate)
 
 
 class Orientation:
-    def __init__(self, angle: Radian):
+    def __init__(self, angle: Radian, increment: Radian = 0):
         self.angle = angle % math.tau
+        self.increment = increment
 
     def __eq__(self, other):
         if isinstance(other, Orientation):
@@ -77,25 +115,47 @@ class Orientation:
         return Orientation(self.angle + direction * math.pi / 2)
 
     def angle_increment(self, angle_increment: Radian) -> "Orientation":
-        return Orientation(self.angle + angle_increment)
+        return Orientation(self.angle + angle_increment, self.increment)
+
+    def turn(self, direction: Literal[-1, 1]) -> "Orientation":
+        return self.angle_increment(direction * self.increment)
+
+    def unit_vector(self) -> tuple[float, float]:
+        return (math.cos(self.angle), math.sin(self.angle))
+
+
+class IntOrientation:
+    """
+    Orientation reached after a number of increments, for an increment that
+    comes back to the initial angle after `len(unit_vectors)` turns.
 
-    def to_vector(self, scale: float) -> Vector2D:
-        return Vector2D(scale * math.cos(self.angle), scale * math.sin(self.angle))
+    The turns are counted modulo that period, so turning is an integer add
+    and comparing orientations is exact.
+    """
+
+    def __init__(self, turns: int, unit_vectors: tuple[tuple[float, float], ...]):
+        self.turns = turns % len(unit_vectors)
+        self.unit_vectors = unit_vectors
+
+    def __eq__(self, other):
+        if isinstance(other, IntOrientation):
+            return self.turns == other.turns
+        return False
+
+    def turn(self, direction: Literal[-1, 1]) -> "IntOrientation":
+        return IntOrientation(self.turns + direction, self.unit_vectors)
+
+    def unit_vector(self) -> tuple[float, float]:
+        return self.unit_vectors[self.turns]
 
 
 class PositionRange:
+    __slots__ = ("min", "max")
+
     def __init__(self, min: float = math.inf, max: float = -math.inf):
         self.min = min
         self.max = max
 
-    def update(self, curr_pos: float) -> "PositionRange":
-        if curr_pos < self.min:
-            return PositionRange(min=curr_pos, max=self.max)
-        elif curr_pos > self.max:
-            return PositionRange(min=self.min, max=curr_pos)
-        else:
-            return self
-
     def __str__(self):
         return f"(min={self.min:.2f}, max={self.max:.2f})"
 
@@ -111,87 +171,187 @@ class ProgramWithMeta:
     init_angle: Radian
 
 
-@dataclass
-class TurtleState:
-    position: Position3D
-    orientation: Orientation
-
-    def __eq__(self, other) -> bool:
-        if isinstance(other, TurtleState):
-            return (
-                self.position == other.position
-                and self.orientation == other.orientation
-            )
-        return False
-
-
 def deg_to_rad(angle: float) -> Radian:
     return angle / 180 * math.pi
 
 
+def orientation_period(angle_increment: Radian) -> Optional[int]:
+    """
+    Smallest number of increments making a whole number of turns, if there is
+    one of at most MAX_PERIOD.
+    """
+    for period in range(1, MAX_PERIOD + 1):
+        turns = period * angle_increment / math.tau
+        if round(turns) != 0 and math.isclose(turns, round(turns), abs_tol=1e-9):
+            return period
+    return None
+
+
+def unit_vector_table(
+    init_angle: Radian, angle_increment: Radian, period: int
+) -> tuple[tuple[float, float], ...]:
+    return tuple(
+        (math.cos(init_angle + k * angle_increment), math.sin(init_angle + k * angle_increment))
+        for k in range(period)
+    )
+
+
+def initial_orientation(
+    init_angle: Radian, angle_increment: Radian
+) -> Orientation | IntOrientation:
+    period = orientation_period(angle_increment)
+    if period is None:
+        return Orientation(init_angle, angle_increment)
+    return IntOrientation(0, unit_vector_table(init_angle, angle_increment, period))
+
+
+def prune_silent_branches(symbols: bytes) -> bytes:
+    """
+    Symbols without the bracket groups that never draw.
+
+    A pop restores the state of its push, so such a group only moves the tool
+    back and forth without drawing. Removing innermost groups until none is
+    left draws the same figure with less to interpret.
+    """
+    while True:
+        (symbols, nb_removed) = SILENT_BRANCH.subn(b"", symbols)
+        if nb_removed == 0:
+            return symbols
+
+
+def trace_unbranched(
+    symbols: bytes,
+    angle_increment: Radian,
+    step_size: float,
+    init_angle: Radian = 0,
+    init_pos: Vector2D = Vector2D()
+) -> tuple[list[float], list[float]]:
+    """
+    Positions reached after each draw symbol of a program without brackets.
+
+    Without a stack, the orientation is a running sum of the turn increments
+    and the position a running sum of the step vectors, so the whole walk is
+    a few accumulate passes instead of the stateful turtle loop.
+    """
+    # The leading 0 skips the initial value accumulate yields before the first symbol
+    draws = b"\x00" + symbols.translate(DRAW_MASK)
+    period = orientation_period(angle_increment)
+    if period is None:
+        increments = [0.0] * 256
+        increments[TURN_LEFT] = angle_increment
+        increments[TURN_RIGHT] = -angle_increment
+        angles = compress(accumulate((increments[s] for s in symbols), initial=init_angle), draws)
+        vectors = [(math.cos(angle), math.sin(angle)) for angle in angles]
+    else:
+        turn_counts = [0] * 256
+        turn_counts[TURN_LEFT] = 1
+        turn_counts[TURN_RIGHT] = -1
+        turns = compress(accumulate((turn_counts[s] for s in symbols), initial=0), draws)
+        table = unit_vector_table(init_angle, angle_increment, period)
+        vectors = [table[t % period] for t in turns]
+    xs = list(accumulate((step_size * cos for (cos, _) in vectors), initial=init_pos.x))
+    ys = list(accumulate((step_size * sin for (_, sin) in vectors), initial=init_pos.y))
+    return (xs[1:], ys[1:])
+
+
 def build_g_code(
-    symbols: list[Symbol],
+    symbols: bytes,
     angle_increment: Radian,
     step_size: float,
     init_angle: Radian = 0,
     init_pos: Vector2D = Vector2D()
 ) -> tuple[GCodeProgram, PositionRange, PositionRange]:
-    state: TurtleState = TurtleState(
-        position=Position3D(x=init_pos.x, y=init_pos.y, z=LINE_DEPTH), orientation=Orientation(init_angle)
-    )
-    stack: list[TurtleState] = []
-    x_range: PositionRange = PositionRange()
-    y_range: PositionRange = PositionRange()
     program: GCodeProgram = [
         GCodeInstruction(
             Command.RAPID_POSITIONING, dst_pos=Position3D(x=init_pos.x, y=init_pos.y, z=10), feed_rate=None
-        ),
+        ).build(),
         GCodeInstruction(
             Command.LINEAR_INTERPOLATION, dst_pos=Position3D(x=init_pos.x, y=init_pos.y, z=LINE_DEPTH)
-        ),
+        ).build(),
     ]
-    for s in symbols:
-        if s == "+":
-            state.orientation = state.orientation.angle_increment(angle_increment)
-        elif s == "-":
-            state.orientation = state.orientation.angle_increment(-angle_increment)
-        elif s == "F" or s == "G":
-            state.position = state.position.add(state.orientation.to_vector(step_size))
-            x_range = x_range.update(state.position.x)
-            y_range = y_range.update(state.position.y)
-            program.append(
-                GCodeInstruction(
-                    command=Command.LINEAR_INTERPOLATION,
-                    dst_pos=state.position,
-                )
-            )
-        elif s == "[":
-            # stack push
-            stack.append(copy(state))
-        elif s == "]":
-            prev_state = stack.pop()
-            if prev_state == state:
-                # optimization: don't move if popped state same as current state
-                continue
-            above_curr = state.position.above()
-            above_prev = prev_state.position.above()
-            program += [
-                # First, we move back up
-                GCodeInstruction(command=Command.RAPID_POSITIONING, dst_pos=above_curr),
-                # Then, we move above the previous position
-                GCodeInstruction(command=Command.RAPID_POSITIONING, dst_pos=above_prev),
-                # Then, we move back down to the previous position
-                GCodeInstruction(
-                    command=Command.LINEAR_INTERPOLATION, dst_pos=prev_state.position
-                ),
-            ]
-            # reset the state to the state popped from the stack
-            state = prev_state
-        
-        # Other symbols are ignored during drawing
-
-        
-    return (program, x_range, y_range)
+    # The turtle state lives in plain locals: the loop below runs once per symbol
+    (x, y) = (init_pos.x, init_pos.y)
+    if PUSH not in symbols and POP not in symbols:
+        (xs, ys) = trace_unbranched(
+            symbols=symbols,
+            angle_increment=angle_increment,
+            step_size=step_size,
+            init_angle=init_angle,
+            init_pos=init_pos,
+        )
+        program += map(DRAW_FORMAT.__mod__, zip(xs, ys))
+        (x_min, x_max) = (min(xs, default=math.inf), max(xs, default=-math.inf))
+        (y_min, y_max) = (min(ys, default=math.inf), max(ys, default=-math.inf))
+        if xs:
+            (x, y) = (xs[-1], ys[-1])
+    else:
+        orientation = initial_orientation(init_angle, angle_increment)
+        # Step vector of the current orientation, only updated when it changes
+        (cos, sin) = orientation.unit_vector()
+        (dx, dy) = (step_size * cos, step_size * sin)
+        # (x, y, orientation) snapshots of the pushed states
+        stack: list[tuple[float, float, Orientation | IntOrientation]] = []
+        push = stack.append
+        pop = stack.pop
+        # Positions of the current pen-down run, formatted in one batch when
+        # the tool is lifted
+        pen_down: list[tuple[float, float]] = []
+        draw = pen_down.append
+        (x_min, x_max) = (math.inf, -math.inf)
+        (y_min, y_max) = (math.inf, -math.inf)
+        for action in symbols.translate(ACTIONS, delete=NO_ACTION):
+            if action == ACTION_DRAW:
+                x += dx
+                y += dy
+                if x < x_min:
+                    x_min = x
+                if x > x_max:
+                    x_max = x
+                if y < y_min:
+                    y_min = y
+                if y > y_max:
+                    y_max = y
+                draw((x, y))
+            elif action == ACTION_TURN_LEFT:
+                orientation = orientation.turn(1)
+                (cos, sin) = orientation.unit_vector()
+                (dx, dy) = (step_size * cos, step_size * sin)
+            elif action == ACTION_TURN_RIGHT:
+                orientation = orientation.turn(-1)
+                (cos, sin) = orientation.unit_vector()
+                (dx, dy) = (step_size * cos, step_size * sin)
+            elif action == ACTION_PUSH:
+                # stack push
+                push((x, y, orientation))
+            elif action == ACTION_POP:
+                (prev_x, prev_y, prev_orientation) = pop()
+                if prev_x == x and prev_y == y and prev_orientation == orientation:
+                    # optimization: don't move if popped state same as current state
+                    continue
+                program += map(DRAW_FORMAT.__mod__, pen_down)
+                pen_down.clear()
+                program += [
+                    # First, we move back up
+                    TRAVEL_FORMAT % (x, y),
+                    # Then, we move above the previous position
+                    TRAVEL_FORMAT % (prev_x, prev_y),
+                    # Then, we move back down to the previous position
+                    DRAW_FORMAT % (prev_x, prev_y),
+                ]
+                # reset the state to the state popped from the stack
+                (x, y, orientation) = (prev_x, prev_y, prev_orientation)
+                (cos, sin) = orientation.unit_vector()
+                (dx, dy) = (step_size * cos, step_size * sin)
+            else:
+                raise ValueError(f"Symbol without turtle action reached the drawing loop: {action}")
+
+        program += map(DRAW_FORMAT.__mod__, pen_down)
+
+    # Move the tool up out of the material
+    program.append(
+        GCodeInstruction(Command.RAPID_POSITIONING, dst_pos=Position3D(x=x, y=y, z=5)).build()
+    )
+    return (program, PositionRange(x_min, x_max), PositionRange(y_min, y_max))
 
 
 def compile_program(
@@ -202,7 +362,7 @@ def compile_program(
     init_angle: Radian = 0,
     init_pos: Vector2D = Vector2D()
 ) -> ProgramWithMeta:
-    symbols = system.nth_iteration(nb_iterations)
+    symbols = prune_silent_branches(system.nth_iteration(nb_iterations))
     (code, x_range, y_range) = build_g_code(
         symbols=symbols,
         angle_increment=angle_increment,
@@ -222,22 +382,20 @@ def compile_program(
 
 
 def write_nc(program: ProgramWithMeta, file_name: str) -> None:
-    lines: list[str] = [
+    header: list[str] = [
         f"; x_range = {program.x_range}",
         f"; y_range = {program.y_range}",
         "M3 S10000",  # Start spinning at 10000 rpm
         "G90",  # Absolute mode
         "G21",  # Metric mode (locations in millimeters)
     ]
-    lines += list(map(lambda i: i.build(), program.code))
-    # Move the tool up out of the material
-    last_pos = copy(program.code[-1].dst_pos)
-    last_pos.z = 5
-    lines.append(GCodeInstruction(Command.RAPID_POSITIONING, dst_pos=last_pos).build())
-    # Stop the tool spinning
-    lines.append("M5")
     file_path = f"./build/{file_name}_n{program.nb_iterations}_s{program.step_size:.2f}_ia{program.init_angle:.2f}_ai{program.angle_increment:.2f}.nc"
-    with open(file_path, "w") as file:
-        file.write("\n".join(lines))
+    # Stream the lines through a large buffer rather than joining the whole
+    # program into a single string first
+    with open(file_path, "w", buffering=WRITE_BUFFER_SIZE) as file:
+        file.writelines(f"{line}\n" for line in header)
+        file.writelines(f"{line}\n" for line in program.code)
+        # Stop the tool spinning
+        file.write("M5\n")
 
     print(f"Wrote to '{file_path}'")
@@ -1,33 +1,41 @@
-from typing import Literal
+from typing import Final
 
 
-type Symbol = Literal["A", "B", "X", "F", "G", "+", "-", "[", "]"]
+# Symbols are single ASCII bytes ("A", "B", "X", "F", "G", "+", "-", "[", "]"),
+# which iterate as ints
+type Symbol = int
 
-type ProductionRules = dict[Symbol, list[Symbol]]
+type ProductionRules = dict[bytes, bytes]
 
 
+# Expansion of every symbol without a production rule: the symbol itself
+_IDENTITY: Final[tuple[bytes, ...]] = tuple(bytes([i]) for i in range(256))
+
 
 class LSystem:
     """
     Deterministic, context-free, L-system
     """
 
-    def __init__(self, axiom: list[Symbol], production_rules: ProductionRules):
+    def __init__(self, axiom: bytes, production_rules: ProductionRules):
         self.axiom = axiom
-        self.production_rules = production_rules
-
-    def _next_str(self, curr: list[Symbol]) -> list[Symbol]:
-        out: list[Symbol] = []
-        for s in curr:
-            if s in self.production_rules:
-                out += self.production_rules[s]
-            else:
-                out.append(s)
-        return out
-
-
-    def nth_iteration(self, n: int) -> list[Symbol]:
-        curr: list[Symbol] = self.axiom
+        self.production_rules: dict[Symbol, bytes] = {
+            ord(s): rule for s, rule in production_rules.items()
+        }
+
+    def _next_expansions(self, expansions: tuple[bytes, ...]) -> tuple[bytes, ...]:
+        # The rules are context-free: one more iteration of a symbol is its
+        # rule with every symbol replaced by its current expansion
+        out = list(expansions)
+        for s, rule in self.production_rules.items():
+            out[s] = b"".join(map(expansions.__getitem__, rule))
+        return tuple(out)
+
+
+    def nth_iteration(self, n: int) -> bytes:
+        # Iterate the expansions of the few rule symbols rather than the whole
+        # string, so each iteration only splices large byte chunks together
+        expansions: tuple[bytes, ...] = _IDENTITY
         for _ in range(n):
-            curr = self._next_str(curr)
-        return curr
\ No newline at end of file
+            expansions = self._next_expansions(expansions)
+        return b"".join(map(expansions.__getitem__, self.axiom))